@@ -1,13 +1,23 @@
 import pandas as pd
 import requests
+import threading
 import time
-import json
 import math
+import orjson
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- CONFIGURATION ---
 HUBSPOT_ACCESS_TOKEN = 'Access Token Here'  # Replace this!
-BATCH_SIZE = 10  # Safe limit for free tier (can go up to 100, but 10 is safer)
+BATCH_SIZE = 100  # HubSpot's batch create limit
 API_URL = "https://api.hubapi.com/crm/v3/objects/contacts/batch/create"
+MAX_WORKERS = 8  # Batches in flight at once
+
+# HubSpot Free allows ~100 requests/10sec. We stay slightly under it to be safe.
+RATE_LIMIT_CALLS = 95
+RATE_LIMIT_PERIOD = 10  # seconds
 
 # --- HEADERS ---
 headers = {
@@ -17,10 +27,14 @@ headers = {
 
 def prepare_data_for_hubspot():
     print(" Loading Final Campaign List...")
-    df = pd.read_csv('../data/processed/final_campaign_list.csv')
+    # Only the columns sent to HubSpot, parsed by the multi-threaded pyarrow reader
+    df = pd.read_csv('../data/processed/final_campaign_list.csv',
+                     usecols=['customer_unique_id', 'Tier', 'Marketing_Action'],
+                     engine='pyarrow', dtype_backend='pyarrow')
     
     # 1. GENERATE FAKE EMAILS (Required for HubSpot API uniqueness)
     # We use the unique ID to create a consistent fake email
+    # (Arrow-backed strings: pandas runs this as pyarrow's binary_join_element_wise kernel)
     df['email'] = df['customer_unique_id'] + "@olist.placeholder.com"
     
     # 2. MARK AS NON-MARKETING (To save money)
@@ -29,61 +43,100 @@ def prepare_data_for_hubspot():
     # 3. RENAME COLUMNS to match HubSpot Internal Names
     # You must have created 'olist_user_id' and 'loyalty_tier' in HubSpot first!
     # Mapping: DataFrame Column -> HubSpot Internal Property Name
-    records = []
-    for index, row in df.iterrows():
-        properties = {
-            "email": row['email'],
-            "firstname": "Olist User", # Placeholder
-            "lastname": row['customer_unique_id'][:8], # First 8 chars of ID
-            "olist_user_id": row['customer_unique_id'],
-            "loyalty_tier": row['Tier'],
-            "marketing_action": row['Marketing_Action']
+    df['firstname'] = "Olist User" # Placeholder
+    df['lastname'] = df['customer_unique_id'].str.slice(0, 8) # First 8 chars of ID
+    df = df.rename(columns={
+        'customer_unique_id': 'olist_user_id',
+        'Tier': 'loyalty_tier',
+        'Marketing_Action': 'marketing_action'
+    })
     
-
-            
-        }
-        records.append({"properties": properties})
+    # Build all property dicts in one pass instead of iterating rows
+    properties = df[['email', 'firstname', 'lastname', 'olist_user_id',
+                     'loyalty_tier', 'marketing_action']].to_dict('records')
+    records = [{"properties": props} for props in properties]
     
     return records
 
+class RateLimiter:
+    """
+    Thread-safe sliding-window limiter: allows at most `calls` requests
+    per `period` seconds across all upload workers.
+    """
+    def __init__(self, calls, period):
+        self.calls = calls
+        self.period = period
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.period:
+                    self.timestamps.popleft()
+                if len(self.timestamps) < self.calls:
+                    self.timestamps.append(now)
+                    return
+                wait = self.period - (now - self.timestamps[0])
+            time.sleep(wait)
+
+def build_session():
+    """
+    Creates a Session that reuses TCP/TLS connections across batches and
+    retries rate limits (429) and gateway errors with exponential backoff,
+    honouring HubSpot's Retry-After header.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 502, 503],
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False,  # Hand the last response back so its error gets logged
+    )
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount('https://', HTTPAdapter(pool_maxsize=MAX_WORKERS, max_retries=retry))
+    return session
+
+def post_batch(session, limiter, batch):
+    limiter.acquire()
+    payload = orjson.dumps({"inputs": batch})  # Already bytes, ready to send
+    return session.post(API_URL, data=payload)
+
 def send_to_hubspot(records):
     total_records = len(records)
     num_batches = math.ceil(total_records / BATCH_SIZE)
     
     print(f" Starting Upload: {total_records} contacts in {num_batches} batches...")
     
-    for i in range(num_batches):
-        start_idx = i * BATCH_SIZE
-        end_idx = start_idx + BATCH_SIZE
-        batch = records[start_idx:end_idx]
-        
-        payload = json.dumps({"inputs": batch})
+    batches = [records[i * BATCH_SIZE:(i + 1) * BATCH_SIZE] for i in range(num_batches)]
+    session = build_session()
+    limiter = RateLimiter(RATE_LIMIT_CALLS, RATE_LIMIT_PERIOD)
+    uploaded = 0
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(post_batch, session, limiter, batch): i
+                   for i, batch in enumerate(batches)}
         
-        try:
-            response = requests.post(API_URL, data=payload, headers=headers)
-            
-            # RATE LIMIT HANDLING (429 Error)
-            if response.status_code == 429:
-                print(" Rate Limit Hit. Sleeping for 10 seconds...")
-                time.sleep(10)
-                # Retry logic would go here in production
-                continue
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f" Critical connection error: {e}")
+                # Stop queued batches; the ones already in flight finish
+                for pending in futures:
+                    pending.cancel()
+                break
                 
             if response.status_code not in [200, 201]:
                 print(f" Error Batch {i}: {response.text}")
             else:
+                uploaded += 1
                 # Print progress every 10 batches to avoid spam
-                if i % 10 == 0:
-                    print(f" Batch {i}/{num_batches} uploaded successfully.")
-                    
-            # FREE TIER SAFETY PAUSE
-            # HubSpot Free allows ~100 requests/10sec. 
-            # We sleep slightly to be safe.
-            time.sleep(0.5) 
-            
-        except Exception as e:
-            print(f" Critical connection error: {e}")
-            break
+                if uploaded % 10 == 0:
+                    print(f" {uploaded}/{num_batches} batches uploaded successfully.")
 
 
 